@@ -33,7 +33,8 @@ try:
     query = "Plan a 3-day trip to Paris with a budget of $1500. Show weather and top attractions."
     print(f"\nQuery: {query}\n")
     
-    result = run_agent(query, agent)
+    # Always call the API so a bad key or model config is caught
+    result = run_agent(query, agent, replay=False)
     
     # Show results
     print("\n" + "="*60)
@@ -41,15 +42,16 @@ try:
     print("="*60)
     
     for i, message in enumerate(result["messages"], 1):
-        msg_type = type(message).__name__
-        if hasattr(message, 'content') and message.content:
-            print(f"\n[{i}] {msg_type}:")
-            print(message.content[:500] + "..." if len(message.content) > 500 else message.content)
+        content = getattr(message, 'content', '')
+        tool_calls = getattr(message, 'tool_calls', None)
         
-        if hasattr(message, 'tool_calls') and message.tool_calls:
-            print(f"  → Tool calls: {len(message.tool_calls)}")
-            for tc in message.tool_calls:
-                print(f"    - {tc.get('name', 'unknown')}")
+        if content:
+            print(f"\n[{i}] {type(message).__name__}:")
+            print(content if len(content) <= 500 else content[:500] + "...")
+        
+        if tool_calls:
+            print(f"  → Tool calls: {len(tool_calls)}")
+            print("\n".join(f"    - {tc.get('name', 'unknown')}" for tc in tool_calls))
     
     print("\n" + "="*60)
     print("✅ Test completed successfully!")
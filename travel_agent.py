@@ -4,15 +4,28 @@ Implements a multi-destination itinerary optimization agent
 """
 import os
 import time
+import logging
+import random
+import asyncio
+import threading
+import hashlib
+from datetime import datetime, timezone
+from functools import lru_cache
 from typing import TypedDict, Annotated, Sequence
 from dotenv import load_dotenv
 import operator
 
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage, RemoveMessage, message_chunk_to_message
 from langgraph.graph import StateGraph, END
-from langgraph.prebuilt import ToolNode
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+import aiosqlite
 from google.api_core.exceptions import ResourceExhausted
+try:
+    from langgraph.types import Send
+except ImportError:
+    # Fallback for older versions
+    from langgraph.constants import Send
 try:
     from langgraph.graph.message import add_messages
 except ImportError:
@@ -25,41 +38,120 @@ except ImportError:
 # Load environment variables
 load_dotenv()
 
+# Logging for progress, rate limiting and retries (set LOG_LEVEL=DEBUG for rate limiter waits)
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(message)s",
+)
+logger = logging.getLogger("travel_agent")
+
 # Import tools
-from travel_tools import TRAVEL_TOOLS
+from travel_tools import TRAVEL_TOOLS, ainvoke_tool_cached
+
+# Map tool names to tools for dispatching tool calls
+_TOOLS_BY_NAME = {t.name: t for t in TRAVEL_TOOLS}
 
 # Rate limiting configuration
-RATE_LIMIT_DELAY = float(os.getenv("RATE_LIMIT_DELAY", "2.0"))  # Delay between requests in seconds
+RATE_LIMIT_RPM = float(os.getenv("RATE_LIMIT_RPM", "15"))  # Allowed API requests per minute (<= 0 disables limiting)
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", "5"))  # Maximum retry attempts
 INITIAL_RETRY_DELAY = float(os.getenv("INITIAL_RETRY_DELAY", "5.0"))  # Initial retry delay in seconds
+MAX_RETRY_DELAY = float(os.getenv("MAX_RETRY_DELAY", "60.0"))  # Upper bound for a single backoff in seconds
+MAX_HISTORY_MESSAGES = int(os.getenv("MAX_HISTORY_MESSAGES", "10"))  # Recent messages sent to the LLM
+if MAX_HISTORY_MESSAGES <= 0:
+    raise ValueError("MAX_HISTORY_MESSAGES must be a positive integer")
 
-# Track last API call time for rate limiting
-_last_api_call_time = 0
+# Checkpoint database for persisting agent runs across processes (empty to disable)
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "agent_state.db")
+CHECKPOINT_TTL = float(os.getenv("CHECKPOINT_TTL", "600"))  # Max age in seconds of a replayed answer (<= 0 disables replay)
 
-def rate_limit():
-    """Enforce rate limiting between API calls"""
-    global _last_api_call_time
-    current_time = time.time()
-    time_since_last_call = current_time - _last_api_call_time
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter sized to the API's requests-per-minute quota.
+    
+    Bursts up to the full quota go through immediately; callers only wait
+    once the bucket is empty. Tokens are reserved under a thread lock so the
+    bucket can be shared by callers on any thread or event loop. An rpm of
+    zero or less disables rate limiting.
+    """
     
-    if time_since_last_call < RATE_LIMIT_DELAY:
-        sleep_time = RATE_LIMIT_DELAY - time_since_last_call
-        print(f"⏳ Rate limiting: waiting {sleep_time:.2f} seconds...")
-        time.sleep(sleep_time)
+    def __init__(self, rpm: float):
+        self.rpm = rpm
+        self.capacity = rpm
+        self.tokens = rpm
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
     
-    _last_api_call_time = time.time()
+    def _reserve(self) -> float:
+        """Take one token and return how long to wait before it becomes available"""
+        if self.rpm <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rpm / 60)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens * 60 / self.rpm
+    
+    async def acquire(self):
+        """Wait until a request slot is available"""
+        wait_time = self._reserve()
+        if wait_time > 0:
+            logger.debug("Rate limiting: waiting %.2f seconds", wait_time)
+            await asyncio.sleep(wait_time)
 
-# Initialize Gemini LLM
-def get_llm():
-    """Initialize Google Gemini LLM"""
-    api_key = os.getenv("GEMINI_API_KEY", "")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY not found in environment variables. Please set it in .env file")
+
+# Shared rate limiter for all Gemini API calls
+_rate_limiter = TokenBucket(RATE_LIMIT_RPM)
+
+
+def _server_retry_delay(error: Exception) -> float:
+    """Extract the server-suggested retry delay (in seconds) from a rate limit error, if any"""
+    candidates = [getattr(error, "retry_delay", None)]
+    candidates += [getattr(detail, "retry_delay", None) for detail in (getattr(error, "details", None) or [])]
     
+    for delay in candidates:
+        if delay is None:
+            continue
+        if isinstance(delay, (int, float)):
+            return float(delay)
+        if hasattr(delay, "total_seconds"):
+            return delay.total_seconds()
+        if hasattr(delay, "seconds"):
+            return delay.seconds + getattr(delay, "nanos", 0) / 1e9
+    return 0.0
+
+def _trim_history(messages: Sequence[BaseMessage], max_messages: int = MAX_HISTORY_MESSAGES) -> list:
+    """
+    Keep the original user query plus the most recent messages.
+    If the cut falls inside a block of tool results, it moves back to the
+    AI message that requested them, so tool results always stay paired with
+    their call and the latest AI + tool-results group is never dropped.
+    """
+    if max_messages <= 0:
+        raise ValueError("max_messages must be a positive integer")
+    if len(messages) <= max_messages + 1:
+        return list(messages)
+    
+    start = len(messages) - max_messages
+    while start > 1 and isinstance(messages[start], ToolMessage):
+        start -= 1
+    return [messages[0]] + list(messages[start:])
+
+
+def _model_name() -> str:
+    """Get the configured Gemini model name"""
     # Use newer model names (gemini-pro is deprecated)
     # Options: "gemini-1.5-flash" (faster, free) or "gemini-1.5-pro" (more capable)
-    model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
-    
+    return os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+
+
+@lru_cache(maxsize=1)
+def _cached_llm(model_name: str, api_key: str):
+    """Create the Gemini client once per model/key"""
     return ChatGoogleGenerativeAI(
         model=model_name,
         google_api_key=api_key,
@@ -67,40 +159,100 @@ def get_llm():
     )
 
 
+@lru_cache(maxsize=1)
+def _cached_llm_with_tools(model_name: str, api_key: str):
+    """Bind the travel tools to the Gemini client once per model/key (converts the tool schemas)"""
+    return _cached_llm(model_name, api_key).bind_tools(TRAVEL_TOOLS)
+
+
+def _api_key() -> str:
+    """Get the Gemini API key from the environment"""
+    api_key = os.getenv("GEMINI_API_KEY", "")
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not found in environment variables. Please set it in .env file")
+    return api_key
+
+
+# Initialize Gemini LLM
+def get_llm(model_name: str = None):
+    """Initialize Google Gemini LLM (reuses the client across calls)"""
+    return _cached_llm(model_name or _model_name(), _api_key())
+
+
+def get_llm_with_tools(model_name: str = None):
+    """Get the Gemini LLM with the travel tools bound (reused across calls)"""
+    return _cached_llm_with_tools(model_name or _model_name(), _api_key())
+
+
 # Define the agent state
 class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
 
 
+# Input of a single tools task, sent by the router for each tool call
+class ToolCallState(TypedDict):
+    tool_call: dict
+
+
+# Background event loop shared by all runs, so the cached LLM's async
+# client and the SQLite checkpointer stay bound to a single live loop
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _run_sync(coro):
+    """Run a coroutine to completion, even when called from a running event loop (e.g. Jupyter)"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+    
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+
+async def _acreate_checkpointer():
+    """Open the SQLite checkpointer; must run on the background loop it will be used from"""
+    checkpointer = AsyncSqliteSaver(aiosqlite.connect(CHECKPOINT_DB))
+    await checkpointer.setup()
+    return checkpointer
+
+
 def create_travel_agent():
     """
-    Create and configure the Travel Planner AI Agent using LangGraph
+    Create and configure the Travel Planner AI Agent using LangGraph.
+    The compiled graph is cached, so repeated calls return the same agent.
     """
-    # Initialize LLM
-    llm = get_llm()
-    
-    # Bind tools to LLM
-    llm_with_tools = llm.bind_tools(TRAVEL_TOOLS)
-    
-    # Create tool node
-    tool_node = ToolNode(TRAVEL_TOOLS)
+    return _cached_agent(_model_name())
+
+
+@lru_cache(maxsize=1)
+def _cached_agent(model_name: str):
+    """Build and compile the agent graph once per model"""
+    # Initialize LLM with tools bound
+    llm_with_tools = get_llm_with_tools(model_name)
     
     # Define the agent node (LLM) with rate limiting and retry logic
-    def agent_node(state: AgentState):
+    async def agent_node(state: AgentState):
         """Agent node that calls the LLM with rate limiting and retry logic"""
-        messages = state["messages"]
-        
-        # Apply rate limiting
-        rate_limit()
+        # Only send recent history; the full transcript stays in the state
+        messages = _trim_history(state["messages"])
         
         # Retry logic with exponential backoff
         retry_count = 0
-        retry_delay = INITIAL_RETRY_DELAY
         
         while retry_count < MAX_RETRIES:
             try:
-                response = llm_with_tools.invoke(messages)
-                return {"messages": [response]}
+                # Apply rate limiting
+                await _rate_limiter.acquire()
+                # Stream the response so tokens arrive as they are generated
+                # (graph.astream(..., stream_mode="messages") surfaces them to UIs)
+                response = None
+                async for chunk in llm_with_tools.astream(messages):
+                    response = chunk if response is None else response + chunk
+                if response is None:
+                    response = AIMessage(content="")
+                return {"messages": [message_chunk_to_message(response)]}
             
             except ResourceExhausted as e:
                 retry_count += 1
@@ -110,41 +262,56 @@ def create_travel_agent():
                         f"Please wait a few minutes before trying again. "
                         f"Error: {str(e)}"
                     )
-                    print(error_msg)
+                    logger.error("Rate limit exceeded after %d retries: %s", MAX_RETRIES, e)
                     # Return an error message instead of crashing
                     error_response = AIMessage(
-                        content=error_msg + "\n\n💡 Tip: The Gemini API has rate limits. Please wait a few minutes and try again, or reduce the number of queries."
+                        content=error_msg + "\n\n💡 Tip: The Gemini API has rate limits. Please wait a few minutes and try again, or reduce the number of queries.",
+                        additional_kwargs={"error": True},
                     )
                     return {"messages": [error_response]}
                 
-                # Exponential backoff with jitter
-                wait_time = retry_delay * (2 ** (retry_count - 1))
-                print(f"⚠️ Rate limit hit. Retrying in {wait_time:.1f} seconds... (Attempt {retry_count}/{MAX_RETRIES})")
-                time.sleep(wait_time)
-                retry_delay = wait_time
+                # Exponential backoff with full jitter, honoring the server-suggested delay
+                jittered = random.uniform(0, min(MAX_RETRY_DELAY, INITIAL_RETRY_DELAY * (2 ** retry_count)))
+                wait_time = max(_server_retry_delay(e), jittered)
+                logger.warning("Rate limit hit, retry %d/%d in %.1fs", retry_count, MAX_RETRIES, wait_time)
+                await asyncio.sleep(wait_time)
             
             except Exception as e:
                 # For other errors, raise immediately
-                print(f"❌ Error: {str(e)}")
+                logger.error("LLM call failed: %s", e)
                 raise
         
         # Should not reach here, but just in case
         error_response = AIMessage(
-            content="❌ Failed to get response from the API after multiple retries. Please try again later."
+            content="❌ Failed to get response from the API after multiple retries. Please try again later.",
+            additional_kwargs={"error": True},
         )
         return {"messages": [error_response]}
     
-    # Define router function to decide next step
-    def should_continue(state: AgentState) -> str:
-        """Determine if we should continue to tools or end"""
-        messages = state["messages"]
-        last_message = messages[-1]
+    # Define the tool node; each instance runs a single tool call
+    async def tool_node(state: ToolCallState):
+        """Tool node that executes one tool call sent by the router"""
+        tool_call = state["tool_call"]
+        tool = _TOOLS_BY_NAME.get(tool_call["name"])
+        if tool is None:
+            result = f"Error: {tool_call['name']} is not a valid tool."
+        else:
+            try:
+                # Async tools run on the event loop; sync tools are run in worker threads
+                result = await ainvoke_tool_cached(tool, tool_call["args"])
+            except Exception as e:
+                result = f"Error: {str(e)}"
         
-        # If the last message has tool calls, go to tools
-        if hasattr(last_message, 'tool_calls') and last_message.tool_calls:
-            return "tools"
-        # Otherwise, end
-        return "end"
+        tool_message = ToolMessage(content=str(result), name=tool_call["name"], tool_call_id=tool_call["id"])
+        return {"messages": [tool_message]}
+    
+    # Define router function to decide next step
+    def should_continue(state: AgentState):
+        """Fan out one tools task per tool call (run in parallel), or end"""
+        tool_calls = getattr(state["messages"][-1], "tool_calls", None)
+        if not tool_calls:
+            return "end"
+        return [Send("tools", {"tool_call": tool_call}) for tool_call in tool_calls]
     
     # Build the graph
     workflow = StateGraph(AgentState)
@@ -169,13 +336,60 @@ def create_travel_agent():
     # Add edge from tools back to agent
     workflow.add_edge("tools", "agent")
     
-    # Compile the graph
-    app = workflow.compile()
+    # Compile the graph, checkpointing runs to SQLite so they survive restarts
+    # (created on the background loop, since the saver binds to the running loop)
+    checkpointer = _run_sync(_acreate_checkpointer()) if CHECKPOINT_DB else None
+    app = workflow.compile(checkpointer=checkpointer)
     
     return app
 
 
-def run_agent(query: str, agent=None, delay_before_start=0):
+def _thread_id(query: str) -> str:
+    """Stable checkpoint thread id for a query, so identical queries share a thread"""
+    return hashlib.sha256(f"{_model_name()}\n{query}".encode("utf-8")).hexdigest()
+
+
+def _is_final_answer(messages: Sequence[BaseMessage]) -> bool:
+    """Check whether a stored run ended with a successful answer from the agent"""
+    if not messages:
+        return False
+    last_message = messages[-1]
+    return (
+        isinstance(last_message, AIMessage)
+        and not last_message.tool_calls
+        and not last_message.additional_kwargs.get("error")
+    )
+
+
+def _is_fresh(created_at: str) -> bool:
+    """Check whether a checkpoint is recent enough (CHECKPOINT_TTL) to replay"""
+    if CHECKPOINT_TTL <= 0 or not created_at:
+        return False
+    created = datetime.fromisoformat(created_at)
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - created).total_seconds() < CHECKPOINT_TTL
+
+
+async def _arun_agent(query: str, agent, replay: bool = True):
+    """Run the agent, replaying a recent checkpointed answer for a previously completed identical query"""
+    config = {"configurable": {"thread_id": _thread_id(query)}}
+    messages = [HumanMessage(content=query)]
+    
+    if getattr(agent, "checkpointer", None) is not None:
+        snapshot = await agent.aget_state(config)
+        stored = snapshot.values.get("messages", [])
+        if replay and _is_final_answer(stored) and _is_fresh(snapshot.created_at):
+            logger.info("Reusing checkpointed answer for this query")
+            return snapshot.values
+        
+        # Discard an earlier run (unfinished, failed, stale or not replayed) before starting over
+        messages = [RemoveMessage(id=m.id) for m in stored] + messages
+    
+    return await agent.ainvoke({"messages": messages}, config=config)
+
+
+def run_agent(query: str, agent=None, delay_before_start=0, replay=True):
     """
     Run the travel agent with a query
     
@@ -183,6 +397,7 @@ def run_agent(query: str, agent=None, delay_before_start=0):
         query: User query string
         agent: Optional pre-initialized agent (for efficiency)
         delay_before_start: Optional delay in seconds before starting (for rate limiting)
+        replay: Reuse a recent checkpointed answer for an identical query instead of calling the API
     
     Returns:
         Final response from the agent
@@ -192,16 +407,11 @@ def run_agent(query: str, agent=None, delay_before_start=0):
     
     # Optional delay before starting (useful when running multiple queries)
     if delay_before_start > 0:
-        print(f"⏳ Waiting {delay_before_start} seconds before starting...")
+        logger.info("Waiting %s seconds before starting", delay_before_start)
         time.sleep(delay_before_start)
     
-    # Create initial state
-    initial_state = {
-        "messages": [HumanMessage(content=query)]
-    }
-    
-    # Run the agent
-    result = agent.invoke(initial_state)
+    # Run the agent (async graph so tool calls can run concurrently)
+    result = _run_sync(_arun_agent(query, agent, replay))
     
     return result
 
@@ -1,15 +1,192 @@
 """
 Travel Planner AI Tools
-Implements 4 tools: Weather, Attractions, Budget Optimizer, and Flight/Hotel Search
+Implements 4 tools: Weather, Attractions, Budget Optimizer, and Flight/Hotel Search,
+plus a plan executor that runs several of them in a single tool call
 """
 from typing import Dict, List, Any
 from langchain.tools import tool
-import requests
+from langchain_core.tools import StructuredTool
+from pydantic import BaseModel, Field
+import httpx
+import asyncio
 import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
 
 
-@tool
-def get_weather_forecast(city: str, days: int = 5) -> str:
+# OpenWeatherMap free API (mock data is returned when no key is set)
+_WEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY", "")
+_WEATHER_URL = "https://api.openweathermap.org/data/2.5/forecast"
+
+# Retry policy for live API calls: retry these statuses with exponential backoff
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+_HTTP_RETRIES = 3
+_HTTP_BACKOFF = 0.5  # seconds, doubled on each retry
+_HTTP_LIMITS = httpx.Limits(max_connections=20)
+_HTTP_TIMEOUT = httpx.Timeout(10.0, connect=3.05)
+
+
+@lru_cache(maxsize=1)
+def _http_client() -> httpx.Client:
+    """Pooled HTTP/2 client for sync tool calls (created on first use)"""
+    return httpx.Client(
+        transport=httpx.HTTPTransport(http2=True, retries=_HTTP_RETRIES, limits=_HTTP_LIMITS),
+        timeout=_HTTP_TIMEOUT,
+    )
+
+
+@lru_cache(maxsize=1)
+def _ahttp_client() -> httpx.AsyncClient:
+    """Pooled HTTP/2 client for async tool calls (created on first use)"""
+    return httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(http2=True, retries=_HTTP_RETRIES, limits=_HTTP_LIMITS),
+        timeout=_HTTP_TIMEOUT,
+    )
+
+
+def _get_with_retry(url: str, params: Dict[str, Any]) -> httpx.Response:
+    """GET a URL, retrying rate limit and server errors with backoff"""
+    for attempt in range(_HTTP_RETRIES + 1):
+        response = _http_client().get(url, params=params)
+        if response.status_code not in _RETRY_STATUSES or attempt == _HTTP_RETRIES:
+            response.raise_for_status()
+            return response
+        time.sleep(_HTTP_BACKOFF * (2 ** attempt))
+
+
+async def _aget_with_retry(url: str, params: Dict[str, Any]) -> httpx.Response:
+    """Async variant of _get_with_retry"""
+    for attempt in range(_HTTP_RETRIES + 1):
+        response = await _ahttp_client().get(url, params=params)
+        if response.status_code not in _RETRY_STATUSES or attempt == _HTTP_RETRIES:
+            response.raise_for_status()
+            return response
+        await asyncio.sleep(_HTTP_BACKOFF * (2 ** attempt))
+
+
+# Mock weather forecast for demo (used when no OpenWeatherMap key is set)
+_MOCK_FORECAST = [
+    {"day": 1, "temp": "22°C", "condition": "Sunny", "humidity": "65%"},
+    {"day": 2, "temp": "24°C", "condition": "Partly Cloudy", "humidity": "70%"},
+    {"day": 3, "temp": "21°C", "condition": "Rainy", "humidity": "80%"},
+    {"day": 4, "temp": "23°C", "condition": "Sunny", "humidity": "68%"},
+    {"day": 5, "temp": "25°C", "condition": "Clear", "humidity": "62%"},
+]
+
+# Mock attraction database
+_ATTRACTIONS_DB: Dict[str, List[Dict[str, Any]]] = {
+    "paris": [
+        {"name": "Eiffel Tower", "type": "landmark", "rating": 4.8, "price": "€25"},
+        {"name": "Louvre Museum", "type": "museum", "rating": 4.9, "price": "€17"},
+        {"name": "Notre-Dame Cathedral", "type": "landmark", "rating": 4.7, "price": "Free"},
+        {"name": "Champs-Élysées", "type": "landmark", "rating": 4.6, "price": "Free"},
+    ],
+    "tokyo": [
+        {"name": "Tokyo Skytree", "type": "landmark", "rating": 4.7, "price": "¥2,100"},
+        {"name": "Senso-ji Temple", "type": "landmark", "rating": 4.6, "price": "Free"},
+        {"name": "Shibuya Crossing", "type": "landmark", "rating": 4.5, "price": "Free"},
+        {"name": "Tokyo National Museum", "type": "museum", "rating": 4.8, "price": "¥1,000"},
+    ],
+    "new york": [
+        {"name": "Statue of Liberty", "type": "landmark", "rating": 4.7, "price": "$24"},
+        {"name": "Central Park", "type": "park", "rating": 4.8, "price": "Free"},
+        {"name": "Metropolitan Museum of Art", "type": "museum", "rating": 4.9, "price": "$30"},
+        {"name": "Times Square", "type": "landmark", "rating": 4.6, "price": "Free"},
+    ],
+    "london": [
+        {"name": "Big Ben", "type": "landmark", "rating": 4.7, "price": "Free"},
+        {"name": "British Museum", "type": "museum", "rating": 4.8, "price": "Free"},
+        {"name": "Tower Bridge", "type": "landmark", "rating": 4.6, "price": "£12"},
+        {"name": "Hyde Park", "type": "park", "rating": 4.7, "price": "Free"},
+    ],
+}
+
+# Attractions indexed by city and type ("all" holds the full list)
+_ATTR_BY_CAT: Dict[str, Dict[str, List[Dict[str, Any]]]] = {
+    city: {"all": rows, **{t: [a for a in rows if a["type"] == t] for t in {r["type"] for r in rows}}}
+    for city, rows in _ATTRACTIONS_DB.items()
+}
+
+# Default attractions for unknown cities: (name template, type, rating, price)
+_DEFAULT_ATTR_TEMPLATES = (
+    ("{city} City Center", "landmark", 4.5, "Free"),
+    ("{city} Museum", "museum", 4.4, "$15"),
+    ("{city} Park", "park", 4.3, "Free"),
+)
+
+# Cost estimates per day (in USD)
+_COST_ESTIMATES: Dict[str, int] = {
+    "paris": 150,
+    "tokyo": 120,
+    "new york": 200,
+    "london": 180,
+}
+
+
+@lru_cache(maxsize=256)
+def _format_weather(city: str, days: int) -> str:
+    """Build the weather forecast string for a city (cached per city/days)"""
+    lines = [f"Weather forecast for {city}:"]
+    lines += [
+        f"Day {day['day']}: {day['temp']}, {day['condition']}, Humidity: {day['humidity']}"
+        for day in _MOCK_FORECAST[:days]
+    ]
+    
+    return "\n".join(lines) + "\n"
+
+
+def _format_default_attractions(city: str, category: str) -> str:
+    """Build the tourist attractions string for a city that isn't in the database"""
+    lines = [f"Tourist attractions in {city}:"]
+    lines += [
+        f"{i}. {name.format(city=city)} ({attr_type}) - Rating: {rating}/5, Price: {price}"
+        for i, (name, attr_type, rating, price) in enumerate(
+            (t for t in _DEFAULT_ATTR_TEMPLATES if category == "all" or t[1] == category), 1
+        )
+    ]
+    
+    return "\n".join(lines) + "\n"
+
+
+@lru_cache(maxsize=256)
+def _format_attractions(city: str, category: str) -> str:
+    """Build the tourist attractions string for a city (cached per city/category)"""
+    city_lower = city.lower()
+    if city_lower not in _ATTR_BY_CAT:
+        return _format_default_attractions(city, category)
+    
+    attractions = _ATTR_BY_CAT[city_lower].get(category, [])
+    lines = [f"Tourist attractions in {city}:"]
+    lines += [
+        f"{i}. {attr['name']} ({attr['type']}) - Rating: {attr['rating']}/5, Price: {attr['price']}"
+        for i, attr in enumerate(attractions, 1)
+    ]
+    
+    return "\n".join(lines) + "\n"
+
+
+def _weather_params(city: str) -> Dict[str, str]:
+    """Query parameters for an OpenWeatherMap forecast request"""
+    return {"q": city, "appid": _WEATHER_API_KEY, "units": "metric"}
+
+
+def _format_live_weather(city: str, days: int, data: Dict[str, Any]) -> str:
+    """Build the weather forecast string from an OpenWeatherMap 5-day/3-hour response"""
+    # The API returns 3-hour steps, so every 8th entry starts a new day
+    lines = [f"Weather forecast for {city}:"]
+    lines += [
+        f"Day {i}: {round(entry['main']['temp'])}°C, {entry['weather'][0]['main']}, "
+        f"Humidity: {entry['main']['humidity']}%"
+        for i, entry in enumerate(data.get("list", [])[::8][:days], 1)
+    ]
+    
+    return "\n".join(lines) + "\n"
+
+
+def _get_weather_forecast(city: str, days: int = 5) -> str:
     """
     Get weather forecast for a city using OpenWeatherMap API (free tier).
     
@@ -21,37 +198,37 @@ def get_weather_forecast(city: str, days: int = 5) -> str:
         Weather forecast information as a string
     """
     try:
-        # Using OpenWeatherMap free API
-        # Note: In production, use environment variable for API key
-        api_key = "demo_key"  # Replace with actual key or use env var
-        base_url = "http://api.openweathermap.org/data/2.5/forecast"
-        
-        # For demo purposes, return mock data
-        # In production, uncomment below:
-        # response = requests.get(f"{base_url}?q={city}&appid={api_key}&units=metric")
-        # data = response.json()
-        
-        # Mock weather data for demo
-        mock_weather = {
-            "city": city,
-            "forecast": [
-                {"day": 1, "temp": "22°C", "condition": "Sunny", "humidity": "65%"},
-                {"day": 2, "temp": "24°C", "condition": "Partly Cloudy", "humidity": "70%"},
-                {"day": 3, "temp": "21°C", "condition": "Rainy", "humidity": "80%"},
-                {"day": 4, "temp": "23°C", "condition": "Sunny", "humidity": "68%"},
-                {"day": 5, "temp": "25°C", "condition": "Clear", "humidity": "62%"},
-            ]
-        }
+        # For demo purposes, return mock data unless OPENWEATHER_API_KEY is set
+        if not _WEATHER_API_KEY:
+            return _format_weather(city, days)
         
-        result = f"Weather forecast for {city}:\n"
-        for day in mock_weather["forecast"][:days]:
-            result += f"Day {day['day']}: {day['temp']}, {day['condition']}, Humidity: {day['humidity']}\n"
+        response = _get_with_retry(_WEATHER_URL, _weather_params(city))
+        return _format_live_weather(city, days, response.json())
+    except Exception as e:
+        return f"Error fetching weather: {str(e)}"
+
+
+async def _aget_weather_forecast(city: str, days: int = 5) -> str:
+    """Async variant of _get_weather_forecast used when the agent runs the tool"""
+    try:
+        # For demo purposes, return mock data unless OPENWEATHER_API_KEY is set
+        if not _WEATHER_API_KEY:
+            return _format_weather(city, days)
         
-        return result
+        response = await _aget_with_retry(_WEATHER_URL, _weather_params(city))
+        return _format_live_weather(city, days, response.json())
     except Exception as e:
         return f"Error fetching weather: {str(e)}"
 
 
+# Supports both .invoke() and .ainvoke()
+get_weather_forecast = StructuredTool.from_function(
+    func=_get_weather_forecast,
+    coroutine=_aget_weather_forecast,
+    name="get_weather_forecast",
+)
+
+
 @tool
 def search_tourist_attractions(city: str, category: str = "all") -> str:
     """
@@ -64,54 +241,7 @@ def search_tourist_attractions(city: str, category: str = "all") -> str:
     Returns:
         List of tourist attractions with details
     """
-    # Mock attraction database
-    attractions_db = {
-        "paris": [
-            {"name": "Eiffel Tower", "type": "landmark", "rating": 4.8, "price": "€25"},
-            {"name": "Louvre Museum", "type": "museum", "rating": 4.9, "price": "€17"},
-            {"name": "Notre-Dame Cathedral", "type": "landmark", "rating": 4.7, "price": "Free"},
-            {"name": "Champs-Élysées", "type": "landmark", "rating": 4.6, "price": "Free"},
-        ],
-        "tokyo": [
-            {"name": "Tokyo Skytree", "type": "landmark", "rating": 4.7, "price": "¥2,100"},
-            {"name": "Senso-ji Temple", "type": "landmark", "rating": 4.6, "price": "Free"},
-            {"name": "Shibuya Crossing", "type": "landmark", "rating": 4.5, "price": "Free"},
-            {"name": "Tokyo National Museum", "type": "museum", "rating": 4.8, "price": "¥1,000"},
-        ],
-        "new york": [
-            {"name": "Statue of Liberty", "type": "landmark", "rating": 4.7, "price": "$24"},
-            {"name": "Central Park", "type": "park", "rating": 4.8, "price": "Free"},
-            {"name": "Metropolitan Museum of Art", "type": "museum", "rating": 4.9, "price": "$30"},
-            {"name": "Times Square", "type": "landmark", "rating": 4.6, "price": "Free"},
-        ],
-        "london": [
-            {"name": "Big Ben", "type": "landmark", "rating": 4.7, "price": "Free"},
-            {"name": "British Museum", "type": "museum", "rating": 4.8, "price": "Free"},
-            {"name": "Tower Bridge", "type": "landmark", "rating": 4.6, "price": "£12"},
-            {"name": "Hyde Park", "type": "park", "rating": 4.7, "price": "Free"},
-        ],
-    }
-    
-    city_lower = city.lower()
-    if city_lower not in attractions_db:
-        # Default attractions for unknown cities
-        attractions = [
-            {"name": f"{city} City Center", "type": "landmark", "rating": 4.5, "price": "Free"},
-            {"name": f"{city} Museum", "type": "museum", "rating": 4.4, "price": "$15"},
-            {"name": f"{city} Park", "type": "park", "rating": 4.3, "price": "Free"},
-        ]
-    else:
-        attractions = attractions_db[city_lower]
-    
-    # Filter by category if specified
-    if category != "all":
-        attractions = [a for a in attractions if a["type"] == category]
-    
-    result = f"Tourist attractions in {city}:\n"
-    for i, attr in enumerate(attractions, 1):
-        result += f"{i}. {attr['name']} ({attr['type']}) - Rating: {attr['rating']}/5, Price: {attr['price']}\n"
-    
-    return result
+    return _format_attractions(city, category)
 
 
 @tool
@@ -133,42 +263,39 @@ def optimize_budget(destinations: List[str], total_budget: float, days_per_desti
     total_days = sum(days_per_destination)
     daily_budget = total_budget / total_days
     
-    # Cost estimates per day (in USD)
-    cost_estimates = {
-        "paris": 150,
-        "tokyo": 120,
-        "new york": 200,
-        "london": 180,
-    }
-    
-    result = f"Budget Optimization for {total_budget} USD:\n"
-    result += f"Total days: {total_days}\n"
-    result += f"Average daily budget: ${daily_budget:.2f}\n\n"
+    lines = [
+        f"Budget Optimization for {total_budget} USD:",
+        f"Total days: {total_days}",
+        f"Average daily budget: ${daily_budget:.2f}",
+        "",
+    ]
     
     allocated_budget = 0
     for i, (dest, days) in enumerate(zip(destinations, days_per_destination), 1):
         dest_lower = dest.lower()
-        estimated_daily = cost_estimates.get(dest_lower, 100)
+        estimated_daily = _COST_ESTIMATES.get(dest_lower, 100)
         allocated = days * estimated_daily
         allocated_budget += allocated
         
-        result += f"Destination {i}: {dest} ({days} days)\n"
-        result += f"  Estimated cost: ${allocated:.2f} (${estimated_daily}/day)\n"
-        result += f"  Recommended budget: ${days * daily_budget:.2f}\n"
+        lines += [
+            f"Destination {i}: {dest} ({days} days)",
+            f"  Estimated cost: ${allocated:.2f} (${estimated_daily}/day)",
+            f"  Recommended budget: ${days * daily_budget:.2f}",
+        ]
         
         if allocated > days * daily_budget * 1.2:
-            result += f"  ⚠️ Warning: This destination may exceed budget\n"
-        result += "\n"
+            lines.append("  ⚠️ Warning: This destination may exceed budget")
+        lines.append("")
     
     remaining = total_budget - allocated_budget
-    result += f"Remaining budget: ${remaining:.2f}\n"
+    lines.append(f"Remaining budget: ${remaining:.2f}")
     
     if remaining < 0:
-        result += "⚠️ Budget exceeded! Consider reducing days or choosing cheaper destinations.\n"
+        lines.append("⚠️ Budget exceeded! Consider reducing days or choosing cheaper destinations.")
     elif remaining > total_budget * 0.2:
-        result += "✅ Good budget allocation with buffer for unexpected expenses.\n"
+        lines.append("✅ Good budget allocation with buffer for unexpected expenses.")
     
-    return result
+    return "\n".join(lines) + "\n"
 
 
 @tool
@@ -199,22 +326,70 @@ def search_flights_hotels(origin: str, destination: str, departure_date: str, re
         {"name": "Luxury Resort", "price_per_night": 250, "rating": 4.9, "location": "Waterfront"},
     ]
     
-    result = f"Flight & Hotel Search: {origin} → {destination}\n"
-    result += f"Departure: {departure_date}"
-    if return_date:
-        result += f", Return: {return_date}\n\n"
-    else:
-        result += " (One-way)\n\n"
+    dates = f"Departure: {departure_date}" + (f", Return: {return_date}" if return_date else " (One-way)")
+    lines = [f"Flight & Hotel Search: {origin} → {destination}", dates, "", "FLIGHT OPTIONS:"]
+    lines += [
+        f"{i}. {flight['airline']}: ${flight['price']}, Duration: {flight['duration']}, Stops: {flight['stops']}"
+        for i, flight in enumerate(mock_flights, 1)
+    ]
+    
+    lines += ["", "HOTEL OPTIONS:"]
+    lines += [
+        f"{i}. {hotel['name']} ({hotel['location']}): ${hotel['price_per_night']}/night, Rating: {hotel['rating']}/5"
+        for i, hotel in enumerate(mock_hotels, 1)
+    ]
+    
+    return "\n".join(lines) + "\n"
+
+
+# Tools that can be run by execute_plan
+_PLAN_TOOLS = {
+    t.name: t
+    for t in (get_weather_forecast, search_tourist_attractions, optimize_budget, search_flights_hotels)
+}
+
+
+class PlanStep(BaseModel):
+    """One tool call inside an execute_plan request"""
+    tool: str = Field(description="Name of the tool to run")
+    args: str = Field(default="{}", description="Tool arguments as a JSON object string")
+
+
+@tool
+async def execute_plan(steps: List[PlanStep]) -> str:
+    """
+    Run several travel tools in one call and return all their results together.
+    Prefer this over separate tool calls when a query needs more than one lookup
+    (e.g. weather, attractions and budget for one or more cities).
+    
+    Args:
+        steps: List of steps, each with "tool" (tool name) and "args" (JSON object string,
+            e.g. '{"city": "Paris", "days": 3}'). Available tools: get_weather_forecast,
+            search_tourist_attractions, optimize_budget, search_flights_hotels
+    
+    Returns:
+        Combined results of all steps
+    """
+    steps = [PlanStep.model_validate(step) for step in steps]
     
-    result += "FLIGHT OPTIONS:\n"
-    for i, flight in enumerate(mock_flights, 1):
-        result += f"{i}. {flight['airline']}: ${flight['price']}, Duration: {flight['duration']}, Stops: {flight['stops']}\n"
+    async def run_step(step: PlanStep) -> str:
+        plan_tool = _PLAN_TOOLS.get(step.tool)
+        if plan_tool is None:
+            return f"Error: {step.tool} is not a valid tool."
+        try:
+            args = json.loads(step.args or "{}")
+            if not isinstance(args, dict):
+                return f"Error running {step.tool}: args must be a JSON object"
+            return await ainvoke_tool_cached(plan_tool, args)
+        except Exception as e:
+            return f"Error running {step.tool}: {str(e)}"
     
-    result += "\nHOTEL OPTIONS:\n"
-    for i, hotel in enumerate(mock_hotels, 1):
-        result += f"{i}. {hotel['name']} ({hotel['location']}): ${hotel['price_per_night']}/night, Rating: {hotel['rating']}/5\n"
+    results = await asyncio.gather(*(run_step(step) for step in steps))
     
-    return result
+    return "\n".join(
+        f"[Step {i}: {step.tool}]\n{result}"
+        for i, (step, result) in enumerate(zip(steps, results), 1)
+    )
 
 
 # Export all tools
@@ -223,5 +398,49 @@ TRAVEL_TOOLS = [
     search_tourist_attractions,
     optimize_budget,
     search_flights_hotels,
+    execute_plan,
 ]
 
+
+# Process-local LRU cache of tool results keyed on (tool name, arguments).
+# Entries expire after TOOL_CACHE_TTL seconds so live data (e.g. forecasts) isn't served stale.
+TOOL_CACHE_SIZE = 128
+TOOL_CACHE_TTL = float(os.getenv("TOOL_CACHE_TTL", "600"))
+_TOOL_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (stored_at, result)
+_TOOL_CACHE_LOCK = threading.Lock()
+
+
+async def ainvoke_tool_cached(tool, args: Dict[str, Any]) -> str:
+    """
+    Invoke a tool, reusing the result of a recent call with the same arguments.
+    Error results are not cached.
+    
+    Args:
+        tool: One of TRAVEL_TOOLS
+        args: Tool call arguments
+    
+    Returns:
+        Tool output
+    """
+    key = (tool.name, json.dumps(args, sort_keys=True, default=str))
+    with _TOOL_CACHE_LOCK:
+        entry = _TOOL_CACHE.get(key)
+        if entry is not None:
+            stored_at, result = entry
+            if time.monotonic() - stored_at < TOOL_CACHE_TTL:
+                _TOOL_CACHE.move_to_end(key)
+                return result
+            del _TOOL_CACHE[key]
+    
+    result = await tool.ainvoke(args)
+    
+    # Tools report failures as "Error..." strings; don't keep serving a transient failure
+    if isinstance(result, str) and result.startswith("Error"):
+        return result
+    
+    with _TOOL_CACHE_LOCK:
+        _TOOL_CACHE[key] = (time.monotonic(), result)
+        _TOOL_CACHE.move_to_end(key)
+        if len(_TOOL_CACHE) > TOOL_CACHE_SIZE:
+            _TOOL_CACHE.popitem(last=False)
+    return result